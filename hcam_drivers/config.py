@@ -1,12 +1,18 @@
 # read in config
 from __future__ import absolute_import, print_function, division
 import configobj
+import hashlib
+import json
 import os
 import validate
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 
-from hcam_widgets.misc import createJSON, saveJSON
+from hcam_widgets.misc import createJSON
+
+from hcam_drivers.utils.files import atomic_write
 
 try:
     from importlib import resources as importlib_resources
@@ -14,6 +20,9 @@ except Exception:
     # backport for python 3.6
     import importlib_resources
 
+CONFIG_FILE = os.path.expanduser("~/.hdriver/config")
+APP_FILE = os.path.expanduser("~/.hdriver/app.json")
+
 
 def check_user_dir(g):
     """
@@ -68,26 +77,120 @@ def load_config(g):
     g.cpars.update(config)
 
 
-def write_config(g):
+def config_string(g):
     """
-    Dump application level globals to config file
+    Application level globals as the text of a config file
     """
     configspec_file = str(
         importlib_resources.files("hcam_drivers") / "data" / "configspec.ini"
     )
     config = configobj.ConfigObj({}, configspec=configspec_file)
     config.update(g.cpars)
-    config.filename = os.path.expanduser("~/.hdriver/config")
+    return "\n".join(config.write()) + "\n"
+
+
+def write_config(g):
+    """
+    Dump application level globals to config file
+    """
     try:
-        config.write()
+        atomic_write(CONFIG_FILE, config_string(g))
     except Exception as err:
         g.clog.warn("Could not write config file:\n" + str(err))
 
 
+@inlineCallbacks
+def app_string(g):
+    """
+    Current application settings as JSON text, formatted as saveJSON would
+    """
+    data = yield createJSON(g, full=False)
+    returnValue(json.dumps(data, sort_keys=True, indent=4, separators=(",", ": ")))
+
+
 @inlineCallbacks
 def dump_app(g):
     """
     Dump current application settings to backup
     """
-    json_string = yield createJSON(g, full=False)
-    saveJSON(g, json_string, backup=True)
+    json_string = yield app_string(g)
+    try:
+        atomic_write(APP_FILE, json_string)
+    except Exception as err:
+        g.clog.warn("Could not write application settings:\n" + str(err))
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class AutoSave(object):
+    """
+    Periodically save config and application settings in the background.
+
+    The settings are serialised every `interval` seconds on the GUI thread,
+    which is cheap, and compared by hash with what is on disk. A file is only
+    written once its contents have changed and then stayed the same for one
+    interval, so a burst of edits results in a single write. Writes are made
+    atomically, in a thread, so they never stall the GUI.
+
+    Parameters
+    ----------
+    g : hcam_widgets.globals.Container
+        application globals
+    interval : float
+        time between checks for changes (seconds)
+    """
+
+    def __init__(self, g, interval=10):
+        self.g = g
+        self.interval = interval
+        # hashes of what is on disk, and of changes waiting to settle
+        self._saved = dict()
+        self._pending = dict()
+        for fname in (CONFIG_FILE, APP_FILE):
+            try:
+                with open(fname) as fh:
+                    self._saved[fname] = _digest(fh.read())
+            except IOError:
+                pass
+        self._loop = LoopingCall(self.check)
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    @inlineCallbacks
+    def check(self, debounce=True):
+        """
+        Write any settings which have changed since they were last saved
+
+        If debounce is False, changes are written immediately.
+        """
+        try:
+            json_string = yield app_string(self.g)
+            contents = {CONFIG_FILE: config_string(self.g), APP_FILE: json_string}
+            for fname, text in contents.items():
+                digest = _digest(text)
+                if digest == self._saved.get(fname):
+                    self._pending.pop(fname, None)
+                    continue
+                if debounce and self._pending.get(fname) != digest:
+                    # still changing; wait for it to settle
+                    self._pending[fname] = digest
+                    continue
+                yield deferToThread(atomic_write, fname, text)
+                self._saved[fname] = digest
+                self._pending.pop(fname, None)
+        except Exception as err:
+            self.g.clog.warn("Autosave failed:\n" + str(err))
+
+    def save(self):
+        """
+        Write any unsaved changes now
+        """
+        return self.check(debounce=False)
@@ -0,0 +1,106 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import json
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from hcam_drivers import config
+
+
+class FakeLogger(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+
+class FakePars(object):
+    """
+    Stands in for the instrument and run parameter widgets
+    """
+    def __init__(self, **pars):
+        self.pars = pars
+
+    def dumpJSON(self):
+        return dict(self.pars)
+
+
+class FakeGlobals(object):
+    def __init__(self):
+        self.cpars = dict(expert_level=0, gps_attached=True)
+        self.ipars = FakePars(numexp=10)
+        self.rpars = FakePars(target='SDSS J1234')
+        self.clog = FakeLogger()
+
+
+class TestAutoSave(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+        self.config_file = os.path.join(self.dirname, 'config')
+        self.app_file = os.path.join(self.dirname, 'app.json')
+        for name, value in (('CONFIG_FILE', self.config_file), ('APP_FILE', self.app_file)):
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.g = FakeGlobals()
+
+    def read_app(self):
+        with open(self.app_file) as fh:
+            return json.load(fh)
+
+    @defer.inlineCallbacks
+    def test_save_writes_app_json(self):
+        self.addCleanup(os.umask, os.umask(0o022))
+        autosave = config.AutoSave(self.g)
+        yield autosave.save()
+        self.assertEqual(self.g.clog.warnings, [])
+        self.assertEqual(self.read_app(), dict(appdata=dict(numexp=10),
+                                               user=dict(target='SDSS J1234'),
+                                               gps_attached=1))
+        with open(self.config_file) as fh:
+            self.assertIn('expert_level = 0', fh.read())
+        mode = stat.S_IMODE(os.stat(self.app_file).st_mode)
+        self.assertEqual(mode, 0o644)
+
+    @defer.inlineCallbacks
+    def test_debounce(self):
+        autosave = config.AutoSave(self.g)
+        # first sight of a change only marks it pending
+        yield autosave.check()
+        self.assertFalse(os.path.exists(self.app_file))
+        # written once it has settled
+        yield autosave.check()
+        self.assertEqual(self.read_app()['appdata'], dict(numexp=10))
+
+        # still changing, so not written
+        self.g.ipars.pars['numexp'] = 20
+        yield autosave.check()
+        self.g.ipars.pars['numexp'] = 30
+        yield autosave.check()
+        self.assertEqual(self.read_app()['appdata'], dict(numexp=10))
+        yield autosave.check()
+        self.assertEqual(self.read_app()['appdata'], dict(numexp=30))
+
+    @defer.inlineCallbacks
+    def test_unchanged_not_written(self):
+        yield config.dump_app(self.g)
+        config.write_config(self.g)
+        # settings on disk match, so a new AutoSave writes nothing
+        autosave = config.AutoSave(self.g)
+        with mock.patch.object(config, 'atomic_write') as atomic_write:
+            yield autosave.save()
+        self.assertFalse(atomic_write.called)
+
+    @defer.inlineCallbacks
+    def test_dump_app(self):
+        yield config.dump_app(self.g)
+        self.assertEqual(self.read_app()['user'], dict(target='SDSS J1234'))
+        self.assertEqual(self.g.clog.warnings, [])
@@ -0,0 +1,33 @@
+# Helpers for writing files safely
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import uuid
+
+
+def atomic_write(fname, data):
+    """
+    Write to a file via a temporary file and rename.
+
+    A crash can never leave a partially written file, and readers see either
+    the old or the new contents. The file is created with the usual
+    permissions, as set by the umask.
+
+    Parameters
+    ----------
+    fname: string
+        file to write
+    data: bytes or string
+        contents of file. Strings are encoded as UTF-8
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    tmpname = os.path.join(dirname, '.{}.{}.tmp'.format(basename, uuid.uuid4().hex))
+    fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.rename(tmpname, fname)
+    except Exception:
+        os.unlink(tmpname)
+        raise
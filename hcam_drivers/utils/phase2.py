@@ -0,0 +1,190 @@
+# Download of JSON instrument setups from the GTC phase 2 server
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+
+from hcam_drivers.utils.files import atomic_write
+
+SERVER = "http://gtc-phase2.gtc.iac.es"
+PATH_TEMPLATE = "/science/Parser/sequences/GTC{id:s}-{semester:s}_{obid:04d}.json"
+FNAME_TEMPLATE = "GTC{id:s}-{semester:s}_{obid:04d}.json"
+# stores ETag and Last-Modified headers of downloaded files
+CACHE_FILE = ".gtc_json_cache.json"
+
+
+def _format_proposal_id(proposal_id):
+    """
+    Force proposal ID to be a two digit string
+    """
+    try:
+        proposal_id = int(proposal_id)
+    except:
+        # force to be a string
+        proposal_id = str(proposal_id)
+    else:
+        proposal_id = "{:02d}".format(proposal_id)
+    return proposal_id
+
+
+def parse_ids(spec):
+    """
+    Expand a list of ids and ranges, e.g '1-3,7' -> [1, 2, 3, 7]
+    """
+    ids = []
+    for item in spec.split(","):
+        if "-" in item:
+            start, end = item.split("-")
+            ids.extend(range(int(start), int(end) + 1))
+        else:
+            ids.append(int(item))
+    return ids
+
+
+class Phase2Client(object):
+    """
+    Fetches files from the phase 2 server.
+
+    Each thread keeps its own keep-alive connection, which is re-used for
+    all of that thread's requests.
+    """
+
+    def __init__(self, server=SERVER, timeout=20):
+        url = urlsplit(server)
+        if url.scheme == "https":
+            self.connection_class = http_client.HTTPSConnection
+        else:
+            self.connection_class = http_client.HTTPConnection
+        self.netloc = url.netloc
+        # server may be hosted below the root, e.g http://localhost:8000/phase2
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connection_class(self.netloc, timeout=self.timeout)
+            self.local.conn = conn
+        return conn
+
+    def get(self, path, headers):
+        """
+        GET a path, returning status, response headers and body
+        """
+        # retry once, since server may have closed an idle connection
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("GET", self.prefix + path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                return response.status, response, body
+            except (http_client.HTTPException, OSError):
+                conn.close()
+                self.local.conn = None
+                if attempt == 1:
+                    raise
+
+
+def download_json(client, proposal_id, semester, obid, dirname, cache, force=False):
+    """
+    Download a JSON file, unless the cached copy is up to date
+
+    Returns a tuple of success flag and a message describing the outcome
+    """
+    # convert proposal ID to properly formatted string if its a number
+    proposal_id = _format_proposal_id(proposal_id)
+
+    pars = dict(id=proposal_id, semester=semester, obid=obid)
+    basename = FNAME_TEMPLATE.format(**pars)
+    fname = os.path.join(dirname, basename)
+    path = PATH_TEMPLATE.format(**pars)
+
+    headers = dict()
+    entry = cache.get(basename, dict())
+    if not force and os.path.exists(fname):
+        if "etag" in entry:
+            headers["If-None-Match"] = entry["etag"]
+        if "last_modified" in entry:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        status, response, body = client.get(path, headers)
+    except Exception as err:
+        return False, "{}: download failed - {}".format(basename, err)
+
+    if status == 304:
+        return True, "{}: unchanged".format(basename)
+    if status != 200:
+        return False, "{}: download failed - HTTP {}".format(basename, status)
+
+    try:
+        json.loads(body.decode("utf-8"))
+    except Exception as err:
+        return False, "{}: no such JSON file, or download failed - {}".format(basename, err)
+
+    try:
+        atomic_write(fname, body)
+    except Exception as err:
+        return False, "{}: could not save - {}".format(basename, err)
+    entry = dict()
+    if response.getheader("ETag"):
+        entry["etag"] = response.getheader("ETag")
+    if response.getheader("Last-Modified"):
+        entry["last_modified"] = response.getheader("Last-Modified")
+    cache[basename] = entry
+    return True, "{}: downloaded".format(basename)
+
+
+def load_cache(dirname):
+    try:
+        with open(os.path.join(dirname, CACHE_FILE)) as fh:
+            return json.load(fh)
+    except Exception:
+        return dict()
+
+
+def save_cache(dirname, cache):
+    atomic_write(os.path.join(dirname, CACHE_FILE),
+                 json.dumps(cache, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def download_all(jobs, server=SERVER, dirname="~/.hdriver/apps", workers=8, force=False):
+    """
+    Download many JSON files concurrently
+
+    Returns a list of (success, message) tuples, one for each job
+
+    Parameters
+    ----------
+    jobs: list
+        list of (proposal_id, semester, obid) tuples
+    server: string
+        URL of phase 2 server, which may include a path to prepend
+        to the path of each file
+    dirname: string
+        directory to save files to
+    workers: int
+        number of simultaneous downloads
+    force: bool
+        download even if cached copy is up to date
+    """
+    dirname = os.path.expanduser(dirname)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    cache = load_cache(dirname)
+    client = Phase2Client(server)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(download_json, client, proposal_id, semester, obid,
+                        dirname, cache, force)
+            for proposal_id, semester, obid in jobs
+        ]
+        results = [future.result() for future in futures]
+    save_cache(dirname, cache)
+    return results
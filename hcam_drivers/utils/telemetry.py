@@ -0,0 +1,310 @@
+# Storage and retrieval of telemetry published on hipercam.*.telemetry topics
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import glob
+import shutil
+import numbers
+import pickle
+import tempfile
+import time
+
+import numpy as np
+from twisted.internet.task import LoopingCall
+from twisted.logger import Logger
+
+# name of the column holding time of each record (UNIX seconds)
+TIME_COLUMN = 'timestamp'
+
+
+def flatten_telemetry(tel, prefix=''):
+    """
+    Extract numeric fields from a telemetry dictionary
+
+    Nested dictionaries are flattened, with keys joined by '.'. Quantities are
+    converted to their values. Anything which is not a number or boolean is
+    dropped.
+
+    Parameters
+    ----------
+    tel: dict
+        unpickled telemetry message, without the timestamp
+    prefix: string
+        prefix to add to all keys
+
+    Returns
+    -------
+    fields: dict
+        dictionary of field name, float pairs
+    """
+    fields = dict()
+    for key, val in tel.items():
+        # field names become file names
+        name = prefix + str(key).replace(os.sep, '_')
+        if isinstance(val, dict):
+            fields.update(flatten_telemetry(val, name + '.'))
+            continue
+        # astropy quantities
+        val = getattr(val, 'value', val)
+        if isinstance(val, (numbers.Number, np.number)) and not isinstance(val, complex):
+            fields[name] = float(val)
+    return fields
+
+
+def _chunk_name(t0, t1):
+    return '{:017.6f}_{:017.6f}'.format(t0, t1)
+
+
+def _chunk_range(path):
+    t0, t1 = os.path.basename(path).split('_')
+    return float(t0), float(t1)
+
+
+class TelemetryStore(object):
+    """
+    Append-only columnar store of telemetry, with one directory per topic.
+
+    Records are buffered in memory and written out as chunks. Each chunk is a
+    directory named after the time range it covers, holding one .npy file per
+    field plus a timestamp index. Every record is written exactly once, and
+    chunks are never rewritten, so the cost of a write is bounded by the chunk
+    size. Chunks are written to a temporary directory and renamed into place,
+    so readers never see a partial chunk.
+
+    Parameters
+    ----------
+    root: string
+        directory in which to store telemetry
+    max_records: int
+        flush buffer for a topic when it holds this many records
+    max_age: float
+        flush buffer for a topic when its oldest record is this old (seconds)
+    """
+    def __init__(self, root, max_records=1000, max_age=300):
+        self.root = os.path.expanduser(root)
+        self.max_records = max_records
+        self.max_age = max_age
+        self.buffers = dict()
+
+    def topic_dir(self, topic):
+        return os.path.join(self.root, topic)
+
+    def append(self, topic, timestamp, fields):
+        """
+        Add a record to the buffer for a topic, flushing if buffer is full
+
+        Parameters
+        ----------
+        topic: string
+            telemetry topic
+        timestamp: float
+            time of record (UNIX seconds)
+        fields: dict
+            field name, float pairs
+        """
+        buf = self.buffers.setdefault(topic, [])
+        buf.append((timestamp, fields))
+        if len(buf) >= self.max_records:
+            self.flush_topic(topic)
+
+    def flush(self, now=None):
+        """
+        Write out buffers which are older than max_age.
+
+        If now is None, all buffers are written.
+        """
+        for topic, buf in list(self.buffers.items()):
+            if not buf:
+                continue
+            if now is None or now - buf[0][0] >= self.max_age:
+                self.flush_topic(topic)
+
+    def flush_topic(self, topic):
+        """
+        Write out buffer for a topic as a new chunk.
+
+        The buffer is only cleared once the chunk is in place, so records
+        are kept for the next flush if the write fails.
+        """
+        buf = list(self.buffers.get(topic, []))
+        if not buf:
+            return
+        buf.sort(key=lambda record: record[0])
+        times = np.array([record[0] for record in buf], dtype=np.float64)
+        names = sorted(set(name for record in buf for name in record[1]))
+
+        directory = self.topic_dir(topic)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmpdir = tempfile.mkdtemp(dir=directory, prefix='.tmp')
+        try:
+            np.save(os.path.join(tmpdir, TIME_COLUMN + '.npy'), times)
+            for name in names:
+                column = np.array([record[1].get(name, np.nan) for record in buf],
+                                  dtype=np.float64)
+                np.save(os.path.join(tmpdir, name + '.npy'), column)
+            chunk = os.path.join(directory, _chunk_name(times[0], times[-1]))
+            # two flushes can cover the same time range; never overwrite
+            suffix = 0
+            while os.path.exists(chunk):
+                suffix += 1
+                chunk = os.path.join(directory, _chunk_name(times[0], times[-1] + 1e-6*suffix))
+            os.rename(tmpdir, chunk)
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        # drop written records, keeping any added since the copy was taken
+        del self.buffers[topic][:len(buf)]
+        if not self.buffers[topic]:
+            del self.buffers[topic]
+
+
+class TelemetryRecorder(object):
+    """
+    Decodes telemetry messages and adds them to a TelemetryStore.
+
+    Independent of any WAMP session; on_telemetry is subscribed to the
+    telemetry topics, but messages can also be fed in directly with record.
+
+    Parameters
+    ----------
+    store: TelemetryStore
+        store to add records to
+    flush_interval: float
+        how often to write out buffers older than the store's max_age (seconds)
+    """
+    log = Logger()
+
+    def __init__(self, store, flush_interval=10):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._loop = LoopingCall(self.flush)
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+        self.store.flush()
+
+    def flush(self):
+        try:
+            self.store.flush(now=time.time())
+        except Exception as err:
+            self.log.error('failed to write telemetry: {err}', err=err)
+
+    def record(self, topic, data):
+        """
+        Decode a pickled telemetry message and store it
+        """
+        try:
+            tel = pickle.loads(data)
+            ts = tel.pop('timestamp')
+            self.store.append(topic, float(ts.unix), flatten_telemetry(tel))
+        except Exception as err:
+            self.log.warn('could not record message from {topic}: {err}',
+                          topic=topic, err=err)
+
+    def on_telemetry(self, data, details=None):
+        self.record(details.topic, data)
+
+
+def list_topics(root):
+    """
+    List topics present in a telemetry store
+    """
+    root = os.path.expanduser(root)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.isdir(os.path.join(root, name)) and not name.startswith('.'))
+
+
+def list_chunks(root, topic, start=None, end=None):
+    """
+    List chunks for a topic which overlap a time range
+
+    Only the chunk names are examined, no data is read.
+
+    Parameters
+    ----------
+    root: string
+        directory of telemetry store
+    topic: string
+        telemetry topic
+    start, end: float, optional
+        time range (UNIX seconds)
+    """
+    chunks = []
+    for path in glob.glob(os.path.join(os.path.expanduser(root), topic, '*_*')):
+        t0, t1 = _chunk_range(path)
+        if start is not None and t1 < start:
+            continue
+        if end is not None and t0 > end:
+            continue
+        chunks.append((t0, path))
+    return [path for t0, path in sorted(chunks)]
+
+
+def list_fields(root, topic, start=None, end=None):
+    """
+    List all fields recorded for a topic, optionally within a time range
+    """
+    fields = set()
+    for chunk in list_chunks(root, topic, start, end):
+        fields.update(os.path.splitext(name)[0] for name in os.listdir(chunk))
+    fields.discard(TIME_COLUMN)
+    return sorted(fields)
+
+
+def query(root, topic, start=None, end=None, fields=None):
+    """
+    Extract telemetry for a topic within a time range
+
+    Columns are memory mapped, and only the rows within the time range of
+    the requested fields are read from disk.
+
+    Parameters
+    ----------
+    root: string
+        directory of telemetry store
+    topic: string
+        telemetry topic
+    start, end: float, optional
+        time range (UNIX seconds)
+    fields: list, optional
+        fields to return. If None, all fields are returned
+
+    Returns
+    -------
+    data: dict
+        dictionary of numpy arrays, including the timestamp column, sorted
+        by time. Fields missing from part of the time range are filled with NaN.
+    """
+    chunks = list_chunks(root, topic, start, end)
+    if fields is None:
+        fields = list_fields(root, topic, start, end)
+
+    columns = dict((name, []) for name in [TIME_COLUMN] + list(fields))
+    for chunk in chunks:
+        times = np.load(os.path.join(chunk, TIME_COLUMN + '.npy'), mmap_mode='r')
+        lo = 0 if start is None else np.searchsorted(times, start, side='left')
+        hi = len(times) if end is None else np.searchsorted(times, end, side='right')
+        if hi <= lo:
+            continue
+        columns[TIME_COLUMN].append(np.array(times[lo:hi]))
+        for name in fields:
+            path = os.path.join(chunk, name + '.npy')
+            if os.path.exists(path):
+                column = np.array(np.load(path, mmap_mode='r')[lo:hi])
+            else:
+                column = np.full(hi - lo, np.nan)
+            columns[name].append(column)
+
+    data = dict((name, np.concatenate(vals) if vals else np.array([], dtype=np.float64))
+                for name, vals in columns.items())
+    # chunks written by separate flushes can overlap in time. A stable sort
+    # keeps records with equal times in the order they were written.
+    order = np.argsort(data[TIME_COLUMN], kind='mergesort')
+    return dict((name, column[order]) for name, column in data.items())
@@ -0,0 +1,41 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
+
+from twisted.trial import unittest
+
+from hcam_drivers.utils.files import atomic_write
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+        self.fname = os.path.join(self.dirname, 'app.json')
+
+    def read(self):
+        with open(self.fname, 'rb') as fh:
+            return fh.read()
+
+    def test_write(self):
+        atomic_write(self.fname, '{"a": "é"}')
+        self.assertEqual(self.read(), '{"a": "é"}'.encode('utf-8'))
+        atomic_write(self.fname, b'{}')
+        self.assertEqual(self.read(), b'{}')
+        self.assertEqual(os.listdir(self.dirname), ['app.json'])
+
+    def test_umask(self):
+        self.addCleanup(os.umask, os.umask(0o027))
+        atomic_write(self.fname, b'{}')
+        self.assertEqual(stat.S_IMODE(os.stat(self.fname).st_mode), 0o640)
+
+    def test_failure_keeps_old_file(self):
+        atomic_write(self.fname, b'old')
+        with mock.patch('hcam_drivers.utils.files.os.rename', side_effect=OSError('disk full')):
+            self.assertRaises(OSError, atomic_write, self.fname, b'new')
+        self.assertEqual(self.read(), b'old')
+        self.assertEqual(os.listdir(self.dirname), ['app.json'])
@@ -0,0 +1,134 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from twisted.trial import unittest
+
+from hcam_drivers.utils.files import atomic_write
+from hcam_drivers.utils.phase2 import CACHE_FILE, download_all, parse_ids
+
+# served as http://host:port/phase2/science/Parser/sequences/...
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class Phase2Handler(SimpleHTTPRequestHandler):
+    """
+    Stand-in for the phase 2 server, which records requests and
+    optionally supports ETags
+    """
+    protocol_version = 'HTTP/1.1'
+    etag = None
+    requests = None
+
+    def send_head(self):
+        self.requests.append((self.path, dict(self.headers)))
+        if self.etag is not None and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        return SimpleHTTPRequestHandler.send_head(self)
+
+    def end_headers(self):
+        if self.etag is not None:
+            self.send_header('ETag', self.etag)
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestParseIds(unittest.TestCase):
+
+    def test_parse_ids(self):
+        self.assertEqual(parse_ids('2'), [2])
+        self.assertEqual(parse_ids('1-3,7'), [1, 2, 3, 7])
+
+
+class TestDownload(unittest.TestCase):
+
+    etag = None
+
+    def setUp(self):
+        self.requests = []
+        handler = type(str('Handler'), (Phase2Handler,),
+                       dict(etag=self.etag, requests=self.requests))
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0),
+                                functools.partial(handler, directory=DATA_DIR))
+        thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        self.server = 'http://127.0.0.1:{}/phase2/'.format(self.httpd.server_port)
+
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+
+    def download(self, obids, **kwargs):
+        jobs = [('5', '24A', obid) for obid in obids]
+        return download_all(jobs, self.server, self.dirname, **kwargs)
+
+    def test_download(self):
+        results = self.download([1], workers=2)
+        self.assertEqual(results, [(True, 'GTC05-24A_0001.json: downloaded')])
+        self.assertEqual(self.requests[0][0],
+                         '/phase2/science/Parser/sequences/GTC05-24A_0001.json')
+        with open(os.path.join(self.dirname, 'GTC05-24A_0001.json')) as fh:
+            self.assertEqual(json.load(fh)['appdata']['numexp'], 10)
+        with open(os.path.join(self.dirname, CACHE_FILE)) as fh:
+            self.assertIn('GTC05-24A_0001.json', json.load(fh))
+
+    def test_repeat_is_conditional(self):
+        self.download([1])
+        results = self.download([1])
+        self.assertEqual(results, [(True, 'GTC05-24A_0001.json: unchanged')])
+        headers = self.requests[-1][1]
+        self.assertIn('If-Modified-Since', headers)
+        if self.etag is not None:
+            self.assertEqual(headers['If-None-Match'], self.etag)
+
+        # unless forced
+        results = self.download([1], force=True)
+        self.assertEqual(results, [(True, 'GTC05-24A_0001.json: downloaded')])
+        self.assertNotIn('If-Modified-Since', self.requests[-1][1])
+
+    def test_failures(self):
+        results = self.download([1, 2, 3])
+        self.assertEqual([success for success, msg in results], [True, False, False])
+        self.assertIn('no such JSON file', results[1][1])
+        self.assertIn('HTTP 404', results[2][1])
+        # failed downloads leave nothing behind
+        self.assertEqual(sorted(os.listdir(self.dirname)),
+                         [CACHE_FILE, 'GTC05-24A_0001.json'])
+
+    def test_save_error(self):
+        def fail_json(fname, data):
+            if not fname.endswith(CACHE_FILE):
+                raise OSError('disk full')
+            atomic_write(fname, data)
+
+        with mock.patch('hcam_drivers.utils.phase2.atomic_write', side_effect=fail_json):
+            results = self.download([1])
+        self.assertEqual(results, [(False, 'GTC05-24A_0001.json: could not save - disk full')])
+        # the rest of the run carries on, and the cache is still saved
+        self.assertEqual(os.listdir(self.dirname), [CACHE_FILE])
+
+    def test_server_down(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        results = self.download([1])
+        self.assertFalse(results[0][0])
+        self.assertIn('download failed', results[0][1])
+
+
+class TestDownloadETag(TestDownload):
+
+    etag = '"v1"'
@@ -0,0 +1,185 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from astropy import units as u
+from astropy.time import Time
+from twisted.trial import unittest
+
+from hcam_drivers.utils.telemetry import (TIME_COLUMN, TelemetryRecorder, TelemetryStore,
+                                          flatten_telemetry, list_chunks, list_fields,
+                                          list_topics, query)
+
+TOPIC = 'hipercam.ccd1.telemetry'
+
+
+def message(unix, **fields):
+    """
+    Pickled telemetry message, as published by hcam_devices
+    """
+    fields['timestamp'] = Time(unix, format='unix')
+    return pickle.dumps(fields)
+
+
+class FakeDetails(object):
+    def __init__(self, topic):
+        self.topic = topic
+
+
+class TestFlatten(unittest.TestCase):
+
+    def test_flatten(self):
+        tel = dict(temp=-90.5 * u.deg_C, state='cooling', flow=1, ok=True,
+                   vac=dict(pressure=1e-6 * u.mbar, gauge=dict(id=3, name='ccd1')),
+                   values=[1, 2])
+        self.assertEqual(flatten_telemetry(tel), {
+            'temp': -90.5, 'flow': 1.0, 'ok': 1.0,
+            'vac.pressure': 1e-6, 'vac.gauge.id': 3.0
+        })
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_record_and_query(self):
+        store = TelemetryStore(self.root, max_records=3)
+        recorder = TelemetryRecorder(store)
+        for i in range(7):
+            recorder.on_telemetry(message(1000 + i, temp=i * u.deg_C, state='ok'),
+                                  details=FakeDetails(TOPIC))
+        # two full chunks written, one record still buffered
+        self.assertEqual(len(list_chunks(self.root, TOPIC)), 2)
+        self.assertEqual(len(store.buffers[TOPIC]), 1)
+        recorder.stop()
+        self.assertEqual(len(list_chunks(self.root, TOPIC)), 3)
+        self.assertEqual(store.buffers, dict())
+
+        self.assertEqual(list_topics(self.root), [TOPIC])
+        self.assertEqual(list_fields(self.root, TOPIC), ['temp'])
+        data = query(self.root, TOPIC)
+        # UNIX times are recovered from astropy Time, so allow for rounding
+        np.testing.assert_allclose(data[TIME_COLUMN], 1000 + np.arange(7), rtol=0, atol=1e-6)
+        np.testing.assert_array_equal(data['temp'], np.arange(7))
+
+    def test_bad_message(self):
+        store = TelemetryStore(self.root)
+        recorder = TelemetryRecorder(store)
+        recorder.record(TOPIC, b'not a pickle')
+        recorder.record(TOPIC, pickle.dumps(dict(temp=1)))
+        self.assertEqual(store.buffers, dict())
+        self.flushLoggedErrors()
+
+    def test_max_age(self):
+        store = TelemetryStore(self.root, max_age=60)
+        recorder = TelemetryRecorder(store)
+        now = time.time()
+        recorder.record(TOPIC, message(now - 120, temp=1))
+        recorder.record('hipercam.slide.telemetry', message(now, position=10))
+        recorder.flush()
+        # only the old buffer is written
+        self.assertEqual(list_topics(self.root), [TOPIC])
+        self.assertEqual(list(store.buffers), ['hipercam.slide.telemetry'])
+
+        store.flush(now=now + 60)
+        self.assertEqual(list_topics(self.root), [TOPIC, 'hipercam.slide.telemetry'])
+        self.assertEqual(store.buffers, dict())
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = TelemetryStore(self.root)
+
+    def test_same_time_range(self):
+        self.store.append(TOPIC, 1000.0, dict(temp=1.0))
+        self.store.flush()
+        self.store.append(TOPIC, 1000.0, dict(temp=2.0))
+        self.store.flush()
+        self.assertEqual(len(list_chunks(self.root, TOPIC)), 2)
+        np.testing.assert_array_equal(query(self.root, TOPIC)['temp'], [1.0, 2.0])
+
+    def test_out_of_order(self):
+        for t in (1002.0, 1000.0, 1001.0):
+            self.store.append(TOPIC, t, dict(temp=t))
+        self.store.flush()
+        data = query(self.root, TOPIC)
+        np.testing.assert_array_equal(data[TIME_COLUMN], [1000.0, 1001.0, 1002.0])
+        np.testing.assert_array_equal(data['temp'], data[TIME_COLUMN])
+
+    def test_overlapping_chunks(self):
+        self.store.append(TOPIC, 1000.0, dict(temp=1.0))
+        self.store.append(TOPIC, 1010.0, dict(temp=3.0))
+        self.store.flush()
+        self.store.append(TOPIC, 1005.0, dict(temp=2.0))
+        self.store.flush()
+        data = query(self.root, TOPIC)
+        np.testing.assert_array_equal(data[TIME_COLUMN], [1000.0, 1005.0, 1010.0])
+        np.testing.assert_array_equal(data['temp'], [1.0, 2.0, 3.0])
+        data = query(self.root, TOPIC, 1004, 1010)
+        np.testing.assert_array_equal(data['temp'], [2.0, 3.0])
+
+    def test_missing_store(self):
+        root = os.path.join(self.root, 'missing')
+        self.assertEqual(list_topics(root), [])
+        self.assertEqual(list_fields(root, TOPIC), [])
+        data = query(root, TOPIC, fields=['temp'])
+        self.assertEqual(len(data['temp']), 0)
+
+    def test_query_boundaries(self):
+        for t in range(1000, 1010):
+            self.store.append(TOPIC, float(t), dict(temp=float(t)))
+            if t == 1004:
+                self.store.flush()
+        self.store.flush()
+
+        # end points are inclusive
+        data = query(self.root, TOPIC, 1004, 1006)
+        np.testing.assert_array_equal(data[TIME_COLUMN], [1004, 1005, 1006])
+        data = query(self.root, TOPIC, 1003.5, 1004.5)
+        np.testing.assert_array_equal(data[TIME_COLUMN], [1004])
+        data = query(self.root, TOPIC, start=1008)
+        np.testing.assert_array_equal(data['temp'], [1008, 1009])
+        data = query(self.root, TOPIC, end=1000)
+        np.testing.assert_array_equal(data['temp'], [1000])
+        # chunks outside range are not even opened
+        self.assertEqual(len(list_chunks(self.root, TOPIC, 1005, 1006)), 1)
+        # no data in range
+        data = query(self.root, TOPIC, 2000, 3000, fields=['temp'])
+        self.assertEqual(len(data[TIME_COLUMN]), 0)
+        self.assertEqual(len(data['temp']), 0)
+
+    def test_missing_fields(self):
+        self.store.append(TOPIC, 1000.0, dict(temp=1.0))
+        self.store.append(TOPIC, 1001.0, dict(temp=2.0, flow=5.0))
+        self.store.flush()
+        self.store.append(TOPIC, 1002.0, dict(flow=6.0))
+        self.store.flush()
+
+        data = query(self.root, TOPIC)
+        np.testing.assert_array_equal(data['temp'], [1.0, 2.0, np.nan])
+        np.testing.assert_array_equal(data['flow'], [np.nan, 5.0, 6.0])
+        data = query(self.root, TOPIC, fields=['flow'])
+        self.assertEqual(sorted(data), ['flow', TIME_COLUMN])
+
+    def test_failed_write_keeps_records(self):
+        self.store.append(TOPIC, 1000.0, dict(temp=1.0))
+        with mock.patch('hcam_drivers.utils.telemetry.os.rename',
+                        side_effect=OSError('disk full')):
+            self.assertRaises(OSError, self.store.flush)
+        self.assertEqual(len(self.store.buffers[TOPIC]), 1)
+        # temporary chunk is cleaned up
+        self.assertEqual(os.listdir(os.path.join(self.root, TOPIC)), [])
+
+        self.store.flush()
+        self.assertEqual(self.store.buffers, dict())
+        np.testing.assert_array_equal(query(self.root, TOPIC)['temp'], [1.0])
@@ -0,0 +1,204 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import importlib
+import os
+import shutil
+import stat
+import tempfile
+import warnings
+from unittest import mock
+
+from astropy.time import Time, TimeDelta
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from hcam_drivers.utils import tsync
+from hcam_drivers.utils.tsync import (GetSatInfo, GR_GetMode, GR_GetPosition,
+                                      GR_GetValidity, HWTime, GR_GetSatData,
+                                      ALL_CALLS, DEFAULT_CONCURRENCY, GPSPoller,
+                                      format_status)
+
+# outputs recorded from the TSYNC example programs
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'tsync')
+
+
+def recorded(name):
+    with open(os.path.join(DATA_DIR, name + '.txt')) as fh:
+        return fh.read()
+
+
+def make_fake_program(dirname, program, output_name=None, exit_code=0):
+    """
+    Write a script which stands in for a TSYNC example program
+    """
+    fname = os.path.join(dirname, program)
+    with open(fname, 'w') as fh:
+        fh.write('#!/bin/sh\ncat "{}"\nexit {}\n'.format(
+            os.path.join(DATA_DIR, (output_name or program) + '.txt'), exit_code))
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR)
+    return fname
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_hw_time(self):
+        call = HWTime('/fake')
+        values = call.parse(recorded('HW_GetTime'))
+        self.assertEqual(values, dict(time='2019-05-03 04:05:06.500', synced='1'))
+        self.assertEqual(call.format(values), 'Time: 2019-05-03 04:05:06.500\nSynced:1')
+
+    def test_validity(self):
+        call = GR_GetValidity('/fake')
+        values = call.parse(recorded('GR_GetValidity'))
+        self.assertEqual(values, dict(time_valid=True, pps_valid=False))
+        self.assertEqual(call.format(values), 'Valid output on:\n Time: True\n PPS False')
+
+    def test_position(self):
+        call = GR_GetPosition('/fake')
+        values = call.parse(recorded('GR_GetPosition'))
+        self.assertEqual(values, dict(lat=28.7569, lon=-17.892, height=2326.4))
+        self.assertEqual(
+            call.format(values),
+            'GPS Location:\n Lat (deg): 28.7569\n Lon (deg) -17.8920\n Height (m): 2326'
+        )
+
+    def test_mode(self):
+        call = GR_GetMode('/fake')
+        values = call.parse(recorded('GR_GetMode'))
+        self.assertEqual(values, dict(mode='GPS Receiver Mode: Standard'))
+        self.assertEqual(call.format(values), 'GPS Receiver Mode: Standard')
+
+    def test_sat_info(self):
+        call = GetSatInfo('/fake')
+        values = call.parse(recorded('GetSatInfo'))
+        self.assertEqual(values, dict(info='Device: TSYNC-PCIE\nSatellites tracked: 3'))
+        self.assertEqual(call.format(values), values['info'])
+
+    def test_sat_data(self):
+        call = GR_GetSatData('/fake')
+        values = call.parse(recorded('GR_GetSatData'))
+        # satellites not used in the fit are left out
+        self.assertEqual(values['num_used'], 2)
+        self.assertEqual(values['sats'][1],
+                         dict(sat_id=17, signal=38, used=1, traim=1, status=2))
+        lines = call.format(values).splitlines()
+        self.assertEqual(lines[1], ' SatID Signal Used TRAIM? StatusBits')
+        self.assertEqual(lines[2:], ['     12     45    1      0          0',
+                                     '     17     38    1      1          2'])
+
+    def test_bytes_response(self):
+        values = GR_GetValidity('/fake').parse(recorded('GR_GetValidity').encode())
+        self.assertEqual(values, dict(time_valid=True, pps_valid=False))
+
+    def test_could_not_open(self):
+        for cls in ALL_CALLS:
+            with self.assertRaisesRegex(IOError, 'could not open GPS device'):
+                cls('/fake').parse(recorded('could_not_open'))
+
+    def test_error(self):
+        for cls in ALL_CALLS:
+            with self.assertRaisesRegex(IOError, 'error in function call'):
+                cls('/fake').parse(recorded('error'))
+
+    def test_error_closing_warns(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            GR_GetMode('/fake').parse(recorded('error_closing'))
+        self.assertEqual(len(caught), 1)
+
+    def test_command(self):
+        call = GR_GetSatData('/opt/tsync')
+        self.assertEqual(call.executable, '/opt/tsync/GR_GetSatData')
+        self.assertEqual(call.args, ('0', '0'))
+
+    def test_repr_runs_program(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+        make_fake_program(dirname, 'GR_GetMode')
+        self.assertEqual(repr(GR_GetMode(dirname)), 'GPS Receiver Mode: Standard')
+
+
+class TestGPSPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+
+    def test_defaults(self):
+        with mock.patch.object(tsync.getpass, 'getuser', return_value='hipercam'):
+            poller = GPSPoller()
+        for call in poller.calls:
+            self.assertEqual(os.path.dirname(call.executable),
+                             '/home/hipercam/hipercam-gps/tsync/examples')
+        self.assertEqual(poller.sem.limit, DEFAULT_CONCURRENCY)
+        self.assertLess(DEFAULT_CONCURRENCY, len(ALL_CALLS))
+
+    def test_import_without_user(self):
+        self.addCleanup(importlib.reload, tsync)
+        with mock.patch('getpass.getuser', side_effect=KeyError('no user')):
+            importlib.reload(tsync)
+            self.assertRaises(KeyError, tsync.default_path)
+            # an explicit path does not need the user name
+            tsync.GPSPoller('/fake')
+
+    @defer.inlineCallbacks
+    def test_poll(self):
+        for program in ('HW_GetTime', 'GR_GetValidity', 'GR_GetPosition', 'GR_GetSatData'):
+            make_fake_program(self.dirname, program)
+        # device cannot be opened for this one
+        make_fake_program(self.dirname, 'GR_GetMode', 'could_not_open', exit_code=1)
+        # and GetSatInfo is missing altogether
+
+        updates = []
+        poller = GPSPoller(self.dirname, concurrency=2, on_update=updates.append)
+        cache = yield poller.poll()
+
+        self.assertEqual(set(cache), set(cls.name for cls in ALL_CALLS))
+        self.assertEqual(updates, [cache])
+        for name in ('time', 'validity', 'position', 'satellites'):
+            self.assertTrue(cache[name]['ok'], name)
+            self.assertEqual(cache[name]['error'], '')
+            self.assertIsInstance(cache[name]['timestamp'], Time)
+        self.assertEqual(cache['validity']['values'], dict(time_valid=True, pps_valid=False))
+        self.assertEqual(cache['satellites']['values']['num_used'], 2)
+        self.assertEqual(cache['time']['text'], 'Time: 2019-05-03 04:05:06.500\nSynced:1')
+
+        for name in ('mode', 'info'):
+            self.assertFalse(cache[name]['ok'], name)
+            self.assertIsNone(cache[name]['values'])
+            self.assertTrue(cache[name]['error'])
+            self.assertIsInstance(cache[name]['timestamp'], Time)
+        self.assertEqual(cache['mode']['error'], 'could not open GPS device')
+
+    @defer.inlineCallbacks
+    def test_status(self):
+        make_fake_program(self.dirname, 'GR_GetValidity')
+        poller = GPSPoller(self.dirname, interval=10)
+        yield poller.poll()
+
+        status = poller.status()
+        self.assertIn('[validity: queried at', status)
+        self.assertIn('Valid output on:', status)
+        self.assertIn('query failed', status)
+        self.assertNotIn('STALE', status)
+
+        later = Time.now() + TimeDelta(60, format='sec')
+        self.assertEqual(poller.status(now=later).count('STALE'), len(ALL_CALLS))
+
+
+class TestFormatStatus(unittest.TestCase):
+
+    def test_no_data(self):
+        status = format_status(dict())
+        for cls in ALL_CALLS:
+            self.assertIn('{}: no data yet'.format(cls.name), status)
+
+    def test_age(self):
+        now = Time('2019-05-03 04:05:16')
+        cache = dict(mode=dict(ok=True, text='GPS Receiver Mode: Standard', error='',
+                               values=None, timestamp=Time('2019-05-03 04:05:06')))
+        status = format_status(cache, ['mode'], max_age=5, now=now)
+        self.assertEqual(
+            status.splitlines(),
+            ['[mode: queried at 2019-05-03 04:05:06.000 (10s ago) - STALE]',
+             'GPS Receiver Mode: Standard']
+        )
@@ -0,0 +1,367 @@
+# Tools to query and parse the TSYNC GPS card on the rack PC
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import getpass
+import warnings
+
+from astropy.time import Time
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.internet.utils import getProcessOutput
+from twisted.logger import Logger
+
+try:
+    from subprocess import getoutput
+except ImportError:
+    from commands import getoutput
+
+# maximum number of GPS queries to run at once. The TSYNC card is a single
+# device, so queries beyond this wait their turn.
+DEFAULT_CONCURRENCY = 2
+
+
+def default_path():
+    """
+    Directory containing the TSYNC example programs for the current user
+
+    Worked out when needed rather than on import, since getpass.getuser
+    fails on hosts where the user has no name.
+    """
+    return '/home/{}/hipercam-gps/tsync/examples'.format(getpass.getuser())
+
+
+def convert(val, to_type):
+    return to_type(val.split(':')[1].strip())
+
+
+class GPSCall(object):
+    name = None
+
+    def __init__(self, function, path=None):
+        """
+        Class to call a GPS function.
+
+        Parameters
+        ----------
+        function: string
+            Name of function to call (must be one of the example programs
+            in the TSYNC library). Should include arguments
+        path: string
+            directory containing the TSYNC example programs. Defaults to
+            the result of default_path()
+        """
+        if path is None:
+            path = default_path()
+        self.function = os.path.join(path, function)
+
+    @property
+    def executable(self):
+        return self.function.split()[0]
+
+    @property
+    def args(self):
+        return tuple(self.function.split()[1:])
+
+    def _parse(self, response):
+        """
+        Implement this function to parse results of running function.
+
+        Should return a dictionary of values.
+
+        response: string
+            response from function call
+        """
+        if 'Could not open' in response:
+            raise IOError('could not open GPS device')
+        if 'Error' in response:
+            raise IOError('error in function call:\n' + str(response))
+        if 'error closing' in response:
+            warnings.warn('could not properly close device')
+        return dict()
+
+    def _format(self, values):
+        """
+        Implement this function to turn parsed values into a string for display.
+
+        values: dict
+            parsed values returned by `_parse`
+        """
+        return str(values)
+
+    def parse(self, response):
+        """
+        Parse response from function call, returning a dictionary of values
+        """
+        return self._parse(response.decode() if isinstance(response, bytes) else response)
+
+    def format(self, values):
+        return self._format(values)
+
+    def call(self):
+        """
+        Run function asynchronously.
+
+        Returns a Deferred which fires with the raw response
+        """
+        return getProcessOutput(self.executable, self.args, env=os.environ,
+                                errortoo=True)
+
+    def __repr__(self):
+        response = getoutput(self.function)
+        return self.format(self.parse(response))
+
+
+class HWTime(GPSCall):
+    name = 'time'
+
+    def __init__(self, path=None):
+        super(HWTime, self).__init__('HW_GetTime 0', path)
+
+    def _parse(self, response):
+        super(HWTime, self)._parse(response)
+        year, doy, hr, mins, sec, nsec = (
+            convert(val, int) for val in response.splitlines()[2:8]
+        )
+        time_string = '{}:{}:{}:{}:{:.6f}'.format(
+            year, doy, hr, mins, sec+nsec/1e9
+        )
+        timestamp = Time(time_string, format='yday')
+        synced = response.splitlines()[-1].split(':')[1].strip()
+        return dict(time=timestamp.iso, synced=synced)
+
+    def _format(self, values):
+        return "Time: {time}\nSynced:{synced}".format(**values)
+
+
+class GR_GetValidity(GPSCall):
+    """
+    Checks to see if time or PPS signal is valid.
+    """
+    name = 'validity'
+
+    def __init__(self, path=None):
+        super(GR_GetValidity, self).__init__('GR_GetValidity 0 0', path)
+
+    def _parse(self, response):
+        super(GR_GetValidity, self)._parse(response)
+        time_valid, pps_valid = (
+            bool(convert(val, int)) for val in response.splitlines()[2:4]
+        )
+        return dict(time_valid=time_valid, pps_valid=pps_valid)
+
+    def _format(self, values):
+        return "Valid output on:\n Time: {time_valid}\n PPS {pps_valid}".format(**values)
+
+
+class GR_GetPosition(GPSCall):
+    """
+    Gets receiver position.
+    """
+    name = 'position'
+
+    def __init__(self, path=None):
+        super(GR_GetPosition, self).__init__('GR_GetPosition 0 0', path)
+
+    def _parse(self, response):
+        super(GR_GetPosition, self)._parse(response)
+        lat, lon, height = (
+            convert(val, float) for val in response.splitlines()[2:5]
+        )
+        return dict(lat=lat, lon=lon, height=height)
+
+    def _format(self, values):
+        return "GPS Location:\n Lat (deg): {:.4f}\n Lon (deg) {:.4f}\n Height (m): {:d}".format(
+            values['lat'], values['lon'], int(values['height'])
+        )
+
+
+class GR_GetMode(GPSCall):
+    """
+    Gets mode of operation.
+    """
+    name = 'mode'
+
+    def __init__(self, path=None):
+        super(GR_GetMode, self).__init__('GR_GetMode 0 0', path)
+
+    def _parse(self, response):
+        super(GR_GetMode, self)._parse(response)
+        return dict(mode=response.strip())
+
+    def _format(self, values):
+        return values['mode']
+
+
+class GetSatInfo(GPSCall):
+    """
+    Basic info (device name and number of sats tracked)
+    """
+    name = 'info'
+
+    def __init__(self, path=None):
+        super(GetSatInfo, self).__init__('GetSatInfo 0', path)
+
+    def _parse(self, response):
+        super(GetSatInfo, self)._parse(response)
+        return dict(info=response.strip())
+
+    def _format(self, values):
+        return values['info']
+
+
+class GR_GetSatData(GPSCall):
+    """
+    Table of satellite data
+    """
+    name = 'satellites'
+
+    def __init__(self, path=None):
+        super(GR_GetSatData, self).__init__('GR_GetSatData 0 0', path)
+
+    def _parse(self, response):
+        super(GR_GetSatData, self)._parse(response)
+        sats = []
+        for line in response.splitlines()[4:]:
+            chn, sat_id, sigstr, traim, fit, status = (
+                int(val) for val in line.split(':')[1].split()
+            )
+            if fit == 1:
+                sats.append(dict(sat_id=sat_id, signal=sigstr, used=fit,
+                                 traim=traim, status=status))
+        return dict(num_used=len(sats), sats=sats)
+
+    def _format(self, values):
+        retval = "-------------------------------\n"
+        retval += " SatID Signal Used TRAIM? StatusBits\n"
+        for sat in values['sats']:
+            retval += '{sat_id:7d} {signal:6d} {used:4d} {traim:6d} {status:10d}\n'.format(**sat)
+        return retval
+
+
+# cached results older than this many poll intervals are flagged as stale
+STALE_POLLS = 3
+
+# order in which status is displayed
+ALL_CALLS = [GetSatInfo, GR_GetMode, GR_GetPosition, GR_GetValidity, HWTime, GR_GetSatData]
+
+
+class GPSPoller(object):
+    """
+    Long-lived poller which runs all GPS queries on a schedule.
+
+    Queries are run concurrently, but no more than `concurrency` at once
+    since the TSYNC card is a single device. The parsed results are cached
+    along with the time they were obtained, so that status can be served
+    without touching the device again.
+
+    Parameters
+    ----------
+    path: string
+        directory containing the TSYNC example programs. Defaults to the
+        result of default_path()
+    interval: float
+        time between polls (seconds)
+    concurrency: int
+        maximum number of GPS queries to run at once
+    on_update: callable
+        optional function called with the cache after each poll
+    """
+    log = Logger()
+
+    def __init__(self, path=None, interval=10, concurrency=DEFAULT_CONCURRENCY,
+                 on_update=None):
+        if path is None:
+            path = default_path()
+        self.calls = [cls(path) for cls in ALL_CALLS]
+        self.interval = interval
+        self.sem = defer.DeferredSemaphore(concurrency)
+        self.on_update = on_update
+        self.cache = dict()
+        self._loop = LoopingCall(self.poll)
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.interval, now=True)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    @defer.inlineCallbacks
+    def _query(self, gps_call):
+        entry = dict(timestamp=None, ok=False, values=None, text='', error='')
+        try:
+            response = yield self.sem.run(gps_call.call)
+            values = gps_call.parse(response)
+        except Exception as err:
+            entry['error'] = str(err)
+            self.log.warn('GPS query {name} failed: {err}', name=gps_call.name, err=err)
+        else:
+            entry.update(ok=True, values=values, text=gps_call.format(values))
+        entry['timestamp'] = Time.now()
+        self.cache[gps_call.name] = entry
+        defer.returnValue(entry)
+
+    @defer.inlineCallbacks
+    def poll(self):
+        """
+        Run all GPS queries concurrently and update cache
+        """
+        yield defer.DeferredList([self._query(gps_call) for gps_call in self.calls],
+                                 consumeErrors=True)
+        if self.on_update is not None:
+            try:
+                self.on_update(self.cache)
+            except Exception as err:
+                self.log.warn('GPS update callback failed: {err}', err=err)
+        defer.returnValue(self.cache)
+
+    def status(self, now=None):
+        """
+        Formatted status string from cached values
+
+        Entries older than STALE_POLLS poll intervals are flagged as stale.
+        """
+        return format_status(self.cache, [gps_call.name for gps_call in self.calls],
+                             max_age=STALE_POLLS*self.interval, now=now)
+
+
+def format_status(cache, names=None, max_age=None, now=None):
+    """
+    Turn a cache of GPS query results into a status string
+
+    Every entry is labelled with the time of the query and its age.
+
+    Parameters
+    ----------
+    cache: dict
+        cache of results, keyed by query name, as produced by `GPSPoller`
+    names: list, optional
+        order in which to display results
+    max_age: float, optional
+        entries older than this (seconds) are flagged as stale
+    now: astropy.time.Time, optional
+        current time, defaults to Time.now()
+    """
+    if names is None:
+        names = [cls.name for cls in ALL_CALLS]
+    if now is None:
+        now = Time.now()
+    lines = []
+    for name in names:
+        entry = cache.get(name)
+        if entry is None:
+            lines.extend(['{}: no data yet'.format(name), ''])
+            continue
+        ts = entry['timestamp']
+        age = (now - ts).sec
+        header = '[{}: queried at {} ({:.0f}s ago)'.format(name, ts.iso, age)
+        if max_age is not None and age > max_age:
+            header += ' - STALE'
+        lines.append(header + ']')
+        if entry['ok']:
+            lines.append(entry['text'])
+        else:
+            lines.append('query failed: {}'.format(entry['error']))
+        lines.append('')
+    return '\n'.join(lines)